@@ -1,21 +1,52 @@
-import json
 import logging
 import os
 import requests
 import csv
-import time
+import io
 import datetime
+import functools
+import gzip
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 import azure.functions as func
 from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobServiceClient
+from azure.storage.blob import BlobServiceClient, ContentSettings
 from azure.communication.email import EmailClient
-from azure.core.exceptions import ResourceExistsError
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError, ResourceNotModifiedError
 from azure.keyvault.secrets import SecretClient
+from github_http import ResponseCache, conditional_get, dump_json, github_request, parse_json
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# GitHub GraphQL endpoint and the number of users resolved per GraphQL query
+GRAPHQL_URL = "https://api.github.com/graphql"
+GRAPHQL_USER_BATCH_SIZE = 100
+
+# Upper bound on concurrent GitHub API requests, kept low to respect secondary rate limits
+MAX_CONCURRENT_REQUESTS = 20
+
+# Number of parallel block uploads used for reports larger than a single put
+BLOB_UPLOAD_CONCURRENCY = 4
+
+# Recipients per email send, and how many of those sends run at once
+EMAIL_RECIPIENT_BATCH_SIZE = 50
+EMAIL_SEND_CONCURRENCY = 4
+
+# Column order of the CSV report; report rows are tuples in this order
+CSV_HEADERS = [
+    'Username', 'Email', 'Created At', 'Last Activity At',
+    'Last Active Editor', 'Editor Version', 'Plugin', 'Plugin Version',
+    'Team Slug'
+]
+
+# Email recipients and blob ETag per (container, blob path), kept for the lifetime of a warm worker
+EMAIL_RECIPIENTS_CACHE = {}
+
 # Configuration variables - would usually be stored in Azure Key Vault or as application settings
 # The function uses environment variables to get configuration
 def get_config():
@@ -27,9 +58,20 @@ def get_config():
         'key_vault_name': os.environ.get('KEY_VAULT_NAME'),
         'github_auth_token_secret_name': os.environ.get('GITHUB_AUTH_TOKEN_SECRET_NAME', 'github-auth-token'),
         'communication_service_connection_string': os.environ.get('COMMUNICATION_SERVICE_CONNECTION_STRING'),
-        'sender_email': os.environ.get('SENDER_EMAIL', 'copilot_report@example.com')
+        'sender_email': os.environ.get('SENDER_EMAIL', 'copilot_report@example.com'),
+        'user_cache_blob_path': os.environ.get('USER_CACHE_BLOB_PATH', 'cache/user_cache.json'),
+        'user_cache_ttl_hours': int(os.environ.get('USER_CACHE_TTL_HOURS', '24')),
+        'user_cache_null_email_ttl_hours': int(os.environ.get('USER_CACHE_NULL_EMAIL_TTL_HOURS', '720')),
+        'response_cache_blob_path': os.environ.get('RESPONSE_CACHE_BLOB_PATH', 'cache/response_cache.json'),
+        'team_slugs': parse_team_slugs(os.environ.get('COPILOT_TEAM_SLUGS', '')),
+        'compress_report': os.environ.get('COMPRESS_REPORT', 'true').lower() == 'true'
     }
 
+# Comma-separated team slugs to report on; empty means every team that assigns Copilot seats
+def parse_team_slugs(value):
+    team_slugs = frozenset(slug.strip().lower() for slug in value.split(',') if slug.strip())
+    return team_slugs or None
+
 # Main function that runs as an Azure Function
 def main(mytimer: func.TimerRequest) -> None:
     """
@@ -59,44 +101,119 @@ def main(mytimer: func.TimerRequest) -> None:
             config['github_auth_token_secret_name']
         )
 
-        # Execute the main workflow
-        teams = fetch_teams(config['enterprise_slug'], auth_token)
-        seats_info = get_copilot_billing_seats(config['enterprise_slug'], auth_token, teams)
+        # Load user details cached by previous runs
+        user_cache = load_user_cache(
+            config['blob_storage_connection_string'],
+            config['container_name'],
+            config['user_cache_blob_path']
+        )
+        
+        # Load the ETags and bodies of the seat pages fetched by previous runs
+        response_cache = load_response_cache(
+            config['blob_storage_connection_string'],
+            config['container_name'],
+            config['response_cache_blob_path']
+        )
         
         # Generate filename with date
         today = datetime.now().strftime("%Y_%m_%d")
         filename = f'copilot_billing_seats_{today}.csv'
-        local_file_path = f'/tmp/{filename}'
+        content_type = 'text/csv'
+        if config['compress_report']:
+            filename += '.gz'
+            content_type = 'application/gzip'
+        
+        # The session's pooled connections are closed once the report is built; seat rows are
+        # produced lazily and consumed by save_to_csv, so both calls stay inside the with block
+        with _make_session(auth_token) as session:
+            seat_rows = get_copilot_billing_seats(
+                session,
+                config['enterprise_slug'],
+                config['team_slugs'],
+                response_cache,
+                user_cache,
+                config['user_cache_ttl_hours'],
+                config['user_cache_null_email_ttl_hours']
+            )
+            
+            # Build the CSV in memory; the same bytes are uploaded and attached to the email
+            report_content, seat_count = save_to_csv(seat_rows, compress=config['compress_report'])
         
-        # Save data to CSV locally first, then to Azure Blob Storage
-        save_to_csv(seats_info, local_file_path)
+        # Upload to Azure Blob Storage and send the email report concurrently; they are independent
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            upload_future = executor.submit(
+                upload_to_blob_storage,
+                config['blob_storage_connection_string'],
+                config['container_name'],
+                report_content,
+                filename,
+                content_type
+            )
+            email_future = executor.submit(
+                send_email,
+                config['blob_storage_connection_string'],
+                config['container_name'],
+                config['email_list_blob_path'],
+                config['communication_service_connection_string'],
+                config['sender_email'],
+                report_content,
+                filename,
+                content_type
+            )
+            for future in (upload_future, email_future):
+                future.result()
         
-        # Upload to Azure Blob Storage
-        upload_to_blob_storage(
+        # Persist the updated user cache for the next run, without entries older than the longest TTL
+        save_user_cache(
             config['blob_storage_connection_string'],
             config['container_name'],
-            local_file_path,
-            filename
+            config['user_cache_blob_path'],
+            user_cache,
+            max(config['user_cache_ttl_hours'], config['user_cache_null_email_ttl_hours'])
         )
-        
-        # Send email report
-        send_email(
+        save_response_cache(
             config['blob_storage_connection_string'],
             config['container_name'],
-            config['email_list_blob_path'],
-            config['communication_service_connection_string'],
-            config['sender_email'],
-            local_file_path,
-            filename
+            config['response_cache_blob_path'],
+            response_cache
         )
         
-        logging.info(f'Successfully processed {len(seats_info)} Copilot seats')
+        logging.info(f'Successfully processed {seat_count} Copilot seats')
         
     except Exception as e:
         logging.error(f"Error in main function: {str(e)}", exc_info=True)
         # In a production environment, we would want to alert on failures
         # Here we could add application insights or other monitoring
 
+@functools.lru_cache(maxsize=None)
+def get_azure_credential():
+    """
+    Create the DefaultAzureCredential shared by the Key Vault and Blob Storage clients.
+    
+    DefaultAzureCredential probes several authentication sources and caches the tokens
+    it acquires, so one instance is reused for the lifetime of the worker.
+    
+    Returns:
+        A DefaultAzureCredential instance
+    """
+    # Works with managed identity in production and falls back to other methods
+    # (e.g., environment variables) when developing locally
+    return DefaultAzureCredential()
+
+@functools.lru_cache(maxsize=None)
+def get_secret_client(key_vault_name):
+    """
+    Create a Key Vault SecretClient, cached for the lifetime of the worker.
+    
+    Parameters:
+        key_vault_name: The name of the Azure Key Vault
+        
+    Returns:
+        A SecretClient for the Key Vault
+    """
+    key_vault_url = f"https://{key_vault_name}.vault.azure.net/"
+    return SecretClient(vault_url=key_vault_url, credential=get_azure_credential())
+
 def get_auth_token_from_key_vault(key_vault_name, secret_name):
     """
     Retrieves the GitHub authentication token from Azure Key Vault.
@@ -110,11 +227,7 @@ def get_auth_token_from_key_vault(key_vault_name, secret_name):
     """
     try:
         logging.info(f"Retrieving GitHub auth token from Key Vault: {key_vault_name}")
-        # Use DefaultAzureCredential for authentication, which works with managed identity in production
-        # and falls back to other methods (e.g., environment variables) when developing locally
-        credential = DefaultAzureCredential()
-        key_vault_url = f"https://{key_vault_name}.vault.azure.net/"
-        secret_client = SecretClient(vault_url=key_vault_url, credential=credential)
+        secret_client = get_secret_client(key_vault_name)
         
         # Get the secret containing the GitHub token
         secret = secret_client.get_secret(secret_name)
@@ -123,293 +236,432 @@ def get_auth_token_from_key_vault(key_vault_name, secret_name):
         logging.error(f"Error retrieving auth token from Key Vault: {str(e)}", exc_info=True)
         raise
 
-def fetch_teams(enterprise_slug, token, max_retries=3):
+def _make_session(token):
     """
-    Fetches all teams in the enterprise with pagination handling and retry logic.
+    Creates the HTTP session used for all GitHub API calls.
+    
+    The session reuses pooled keep-alive TCP/TLS connections, sends the GitHub
+    headers with every request and retries connection errors through urllib3's
+    Retry. Error statuses, including 429/503 with Retry-After, are left to
+    github_request alone, which honours Retry-After and adds jitter.
     
     Parameters:
-        enterprise_slug: The GitHub enterprise slug identifier
         token: The GitHub authentication token
-        max_retries: Maximum number of retry attempts for transient errors
         
     Returns:
-        List of teams with their IDs and names
+        A configured requests.Session
     """
-    url = f"https://api.github.com/enterprises/{enterprise_slug}/teams?per_page=100"
-    headers = {
+    session = requests.Session()
+    # GraphQL user queries are read-only POSTs, so they are safe to retry as well
+    retry = Retry(total=5, backoff_factor=0.3, allowed_methods=["GET", "POST"],
+                  respect_retry_after_header=False, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=20, pool_maxsize=100, max_retries=retry)
+    session.mount('https://', adapter)
+    session.headers.update({
         "Authorization": f"Bearer {token}",
         "Accept": "application/vnd.github.v3+json"
-    }
-    teams = []
-    retry_count = 0
+    })
+    return session
+
+def fetch_all_pages(session, url, response_cache=None, description="pages"):
+    """
+    Fetch every page of a paginated GitHub API list.
     
-    while url:
-        try:
-            logging.info(f"Fetching teams from URL: {url}")
-            response = requests.get(url, headers=headers)
-            
-            # Check for rate limiting
-            check_rate_limit(response.headers)
-            
-            if response.status_code == 200:
-                data = response.json()
-                teams.extend([{'id': team['id'], 'name': team['name']} for team in data])
-                
-                # Handle pagination using the Link header
-                url = response.links.get('next', {}).get('url')
-                if url:
-                    logging.info("Fetching next page of teams...")
-                
-                # Reset retry counter on successful request
-                retry_count = 0
-            else:
-                logging.error(f"Failed to fetch teams with status code {response.status_code}. Error: {response.text}")
-                if response.status_code >= 500 and retry_count < max_retries:
-                    retry_count += 1
-                    wait_time = 2 ** retry_count  # Exponential backoff
-                    logging.info(f"Retrying in {wait_time} seconds... (Attempt {retry_count} of {max_retries})")
-                    time.sleep(wait_time)
-                else:
-                    break  # Stop the loop if max retries reached or non-retryable error
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request error while fetching teams: {str(e)}")
-            if retry_count < max_retries:
-                retry_count += 1
-                wait_time = 2 ** retry_count  # Exponential backoff
-                logging.info(f"Retrying in {wait_time} seconds... (Attempt {retry_count} of {max_retries})")
-                time.sleep(wait_time)
-            else:
-                break  # Stop the loop if max retries reached
+    The first page's Link rel="last" URL gives the page count, so the remaining pages
+    are requested concurrently instead of following rel="next" one hop at a time.
+    Lists without a rel="last" link are walked sequentially.
+    
+    Parameters:
+        session: The GitHub API session
+        url: The URL of the first page
+        response_cache: ResponseCache of page ETags and bodies from previous runs, updated in place
+        description: What is being fetched, used in log messages
+        
+    Yields:
+        The parsed body of each page in page order, stopping at the first page that fails
+    """
+    if response_cache is None:
+        response_cache = ResponseCache()
+    
+    data, links = _fetch_page(session, url, response_cache, description)
+    if data is None:
+        return
+    yield data
+    
+    last_url = links.get('last')
+    if last_url:
+        page_count = int(dict(parse_qsl(urlsplit(last_url).query)).get('page', 1))
+        page_urls = [_with_page(last_url, page) for page in range(2, page_count + 1)]
+        
+        # executor.map returns pages in order while they are fetched in parallel
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            for data, _ in executor.map(lambda page_url: _fetch_page(session, page_url, response_cache, description),
+                                        page_urls):
+                if data is None:
+                    return
+                yield data
+        return
+    
+    next_url = links.get('next')
+    while next_url:
+        data, links = _fetch_page(session, next_url, response_cache, description)
+        if data is None:
+            return
+        yield data
+        next_url = links.get('next')
+
+def _fetch_page(session, url, response_cache, description):
+    """
+    Fetch and parse a single page, revalidating any cached copy.
+    
+    Parameters:
+        session: The GitHub API session
+        url: The page URL
+        response_cache: ResponseCache of page ETags and bodies from previous runs, updated in place
+        description: What is being fetched, used in log messages
+        
+    Returns:
+        Tuple of the parsed body (None if the request failed) and the page's Link header URLs
+    """
+    try:
+        logging.info(f"Fetching {description} from URL: {url}")
+        response, body, links = conditional_get(session, url, response_cache)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Request error while fetching {description}: {str(e)}")
+        return None, {}
+    
+    if response.status_code not in (200, 304):
+        logging.error(f"Failed to fetch {description} with status code {response.status_code}. Error: {response.text}")
+        return None, {}
+    
+    return parse_json(body), links
 
-    logging.info(f"Fetched {len(teams)} teams successfully.")
-    return teams
+def _with_page(url, page):
+    """
+    Return the URL with its page query parameter set to the given page number.
+    
+    Parameters:
+        url: A paginated GitHub API URL
+        page: The page number to request
+        
+    Returns:
+        The URL for that page
+    """
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query['page'] = str(page)
+    return urlunsplit(parts._replace(query=urlencode(query)))
 
-def get_user_details(username, auth_token, max_retries=3):
+def get_user_details(session, username):
     """
-    Fetches details like email and created_at for a given GitHub username with retry logic.
+    Fetches details like email and created_at for a given GitHub username.
     
     Parameters:
+        session: The GitHub API session
         username: The GitHub username
-        auth_token: The GitHub authentication token
-        max_retries: Maximum number of retry attempts for transient errors
         
     Returns:
         Tuple containing email and created_at date
     """
     user_api_url = f"https://api.github.com/users/{username}"
-    headers = {
-        "Authorization": f"Bearer {auth_token}"
-    }
     
-    retry_count = 0
-    while retry_count <= max_retries:
-        try:
-            response = requests.get(user_api_url, headers=headers)
-            
-            # Check for rate limiting
-            check_rate_limit(response.headers)
-            
-            if response.status_code == 200:
-                user_data = response.json()
-                email = user_data.get('email') or 'N/A'
-                created_at = user_data.get('created_at') or 'N/A'
-                return email, created_at
-            else:
-                logging.error(f"Failed to fetch details for {username}: {response.status_code} - {response.text}")
-                
-                # Retry for server errors (5xx)
-                if response.status_code >= 500 and retry_count < max_retries:
-                    retry_count += 1
-                    wait_time = 2 ** retry_count  # Exponential backoff
-                    logging.info(f"Retrying in {wait_time} seconds... (Attempt {retry_count} of {max_retries})")
-                    time.sleep(wait_time)
-                else:
-                    return 'N/A', 'N/A'
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request error while fetching user details for {username}: {str(e)}")
-            if retry_count < max_retries:
-                retry_count += 1
-                wait_time = 2 ** retry_count  # Exponential backoff
-                logging.info(f"Retrying in {wait_time} seconds... (Attempt {retry_count} of {max_retries})")
-                time.sleep(wait_time)
-            else:
-                return 'N/A', 'N/A'
+    try:
+        response = github_request(session, 'GET', user_api_url)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Request error while fetching user details for {username}: {str(e)}")
+        return 'N/A', 'N/A'
+    
+    if response.status_code != 200:
+        logging.error(f"Failed to fetch details for {username}: {response.status_code} - {response.text}")
+        return 'N/A', 'N/A'
     
-    return 'N/A', 'N/A'  # Default return if all retries fail
+    user_data = parse_json(response.content)
+    email = user_data.get('email') or 'N/A'
+    created_at = user_data.get('created_at') or 'N/A'
+    return email, created_at
 
-def check_rate_limit(headers):
+def fetch_users_bulk(session, logins):
     """
-    Check and handle GitHub API rate limiting.
+    Fetches email and created_at for many GitHub users using batched GraphQL queries.
+    
+    Each query resolves up to GRAPHQL_USER_BATCH_SIZE users through aliased
+    user(login:) fields, so N users cost ceil(N / 100) requests instead of N.
+    Batches are sent concurrently, at most MAX_CONCURRENT_REQUESTS at a time.
     
     Parameters:
-        headers: The HTTP response headers from a GitHub API request
+        session: The GitHub API session
+        logins: List of GitHub usernames
+        
+    Returns:
+        Dictionary mapping username to a tuple of email and created_at date.
+        Users that could not be resolved are left out of the dictionary.
     """
-    remaining = int(headers.get('X-RateLimit-Remaining', 0))
-    reset_time = int(headers.get('X-RateLimit-Reset', 0))
+    batches = [logins[start:start + GRAPHQL_USER_BATCH_SIZE]
+               for start in range(0, len(logins), GRAPHQL_USER_BATCH_SIZE)]
+    user_details = {}
+    
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        for batch_details in executor.map(lambda batch: _fetch_users_batch(session, batch), batches):
+            user_details.update(batch_details)
     
-    if remaining == 0:
-        wait_time = max(reset_time - time.time(), 0)
-        logging.warning(f"Rate limit reached. Waiting for {wait_time} seconds.")
-        time.sleep(wait_time + 1)  # Wait until the reset time plus a buffer
+    logging.info(f"Fetched details for {len(user_details)} of {len(logins)} users via GraphQL.")
+    return user_details
 
-def get_copilot_billing_seats(enterprise_slug, auth_token, teams, max_retries=3):
+def _fetch_users_batch(session, batch):
     """
-    Fetches the Copilot billing seats data and processes it for each team with retry logic.
+    Resolves a single batch of usernames with one GraphQL request.
     
     Parameters:
-        enterprise_slug: The GitHub enterprise slug identifier
-        auth_token: The GitHub authentication token
-        teams: List of teams to check for
-        max_retries: Maximum number of retry attempts for transient errors
+        session: The GitHub API session
+        batch: List of at most GRAPHQL_USER_BATCH_SIZE GitHub usernames
         
     Returns:
-        List of user information dictionaries
+        Dictionary mapping username to a tuple of email and created_at date
     """
-    api_url = f"https://api.github.com/enterprises/{enterprise_slug}/copilot/billing/seats"
-    headers = {
-        "Authorization": f"Bearer {auth_token}"
+    # Logins are passed as variables rather than interpolated into the query text
+    variables = {f"l{i}": login for i, login in enumerate(batch)}
+    declarations = ", ".join(f"$l{i}: String!" for i in range(len(batch)))
+    fields = " ".join(f"u{i}: user(login: $l{i}) {{ email createdAt }}" for i in range(len(batch)))
+    payload = {
+        "query": f"query({declarations}) {{ {fields} }}",
+        "variables": variables
     }
+    
+    try:
+        response = github_request(session, 'POST', GRAPHQL_URL, json=payload)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Request error while fetching user details via GraphQL: {str(e)}")
+        return {}
+    
+    if response.status_code != 200:
+        logging.error(f"Failed to fetch user details via GraphQL: {response.status_code} - {response.text}")
+        return {}
+    
+    # Unknown users come back as null entries alongside NOT_FOUND errors
+    data = parse_json(response.content).get('data') or {}
+    user_details = {}
+    for i, login in enumerate(batch):
+        user_data = data.get(f"u{i}")
+        if user_data:
+            user_details[login] = (user_data.get('email') or 'N/A', user_data.get('createdAt') or 'N/A')
+    return user_details
 
-    users_info = []
-    page = 1
-    retry_count = 0
+def resolve_user_details(session, logins, user_cache=None, user_cache_ttl_hours=24,
+                         user_cache_null_email_ttl_hours=720):
+    """
+    Resolves email and created_at for the given users, hitting GitHub only for cache misses.
+    
+    Users found in the cache and fetched within the TTL are served from it. Users known to
+    have no public email keep the much longer null-email TTL instead, since created_at
+    never changes and re-fetching them almost always returns nothing new. The rest are
+    fetched in batched GraphQL queries, falling back to the REST API in parallel for users
+    the GraphQL batch could not resolve, and are written back to the cache.
     
-    while True:
-        logging.info(f"Fetching page {page} of Copilot billing seats.")
+    Parameters:
+        session: The GitHub API session
+        logins: List of unique GitHub usernames
+        user_cache: Dictionary of user details from previous runs, updated in place
+        user_cache_ttl_hours: How long a cached user entry stays valid, in hours
+        user_cache_null_email_ttl_hours: How long a cached user without a public email stays valid, in hours
         
-        try:
-            response = requests.get(api_url, headers=headers, params={'page': page})
-            
-            # Check for rate limiting
-            check_rate_limit(response.headers)
+    Returns:
+        Dictionary mapping username to a tuple of email and created_at date
+    """
+    if user_cache is None:
+        user_cache = {}
+    
+    # Serve users fetched within their TTL from the cache
+    now = datetime.now()
+    cutoff = now - timedelta(hours=user_cache_ttl_hours)
+    null_email_cutoff = now - timedelta(hours=user_cache_null_email_ttl_hours)
+    user_details = {}
+    for login in logins:
+        entry = user_cache.get(login)
+        if not entry:
+            continue
+        entry_cutoff = null_email_cutoff if entry['email'] == 'N/A' else cutoff
+        if datetime.fromisoformat(entry['fetched_at']) >= entry_cutoff:
+            user_details[login] = (entry['email'], entry['created_at'])
+    
+    uncached_logins = [login for login in logins if login not in user_details]
+    logging.info(f"Served {len(user_details)} users from cache, fetching {len(uncached_logins)} from GitHub.")
+    user_details.update(fetch_users_bulk(session, uncached_logins))
+    
+    # Fall back to the REST API, in parallel, for users the GraphQL batch could not resolve
+    missing_logins = [login for login in uncached_logins if login not in user_details]
+    if missing_logins:
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            results = executor.map(lambda login: get_user_details(session, login), missing_logins)
+            user_details.update(zip(missing_logins, results))
+    
+    # Cache successful lookups; failed ones have no created_at and are retried next run
+    fetched_at = datetime.now().isoformat()
+    for login in uncached_logins:
+        email, created_at = user_details[login]
+        if created_at != 'N/A':
+            user_cache[login] = {'email': email, 'created_at': created_at, 'fetched_at': fetched_at}
+    
+    return user_details
+
+def get_copilot_billing_seats(session, enterprise_slug, team_slugs=None, response_cache=None, user_cache=None,
+                              user_cache_ttl_hours=24, user_cache_null_email_ttl_hours=720):
+    """
+    Fetches the Copilot billing seats data and processes it for each team.
+    
+    Every seat carries its assigning team's name and slug, so seats are filtered on the
+    seat data itself rather than against a separately fetched team list.
+    
+    Parameters:
+        session: The GitHub API session
+        enterprise_slug: The GitHub enterprise slug identifier
+        team_slugs: Set of lowercase team slugs to report on, or None for every assigning team
+        response_cache: ResponseCache of page ETags and bodies from previous runs, updated in place
+        user_cache: Dictionary of user details from previous runs, updated in place
+        user_cache_ttl_hours: How long a cached user entry stays valid, in hours
+        user_cache_null_email_ttl_hours: How long a cached user without a public email stays valid, in hours
+        
+    Yields:
+        User information rows, in CSV_HEADERS column order
+    """
+    url = f"https://api.github.com/enterprises/{enterprise_slug}/copilot/billing/seats?per_page=100"
+
+    matched_seats = []
+    page_count = 0
+    
+    for data in fetch_all_pages(session, url, response_cache, "Copilot billing seats"):
+        page_count += 1
+        for item in data.get('seats', []):
+            # Skip seats outside the relevant teams before looking at anything else;
+            # assigning_team is null for seats assigned directly to a user
+            assigning_team = item.get('assigning_team')
+            if not assigning_team:
+                continue
+            if team_slugs is not None and (assigning_team.get('slug') or '').lower() not in team_slugs:
+                continue
             
-            if response.status_code == 200:
-                # Reset retry counter on successful request
-                retry_count = 0
-                
-                data = response.json()
-
-                # If no data is returned, break the loop
-                if not data['seats']:
-                    break
-
-                for item in data['seats']:
-                    assigning_team = item.get('assigning_team', {})
-                    assignee = item.get('assignee', {})
-                    team_name = assigning_team.get('name', 'N/A')
-                    
-                    if team_name in [team['name'] for team in teams] and assignee.get('login'):
-                        username = assignee.get('login')
-                        
-                        # Fetch email and created_at using another API call
-                        email, created_at = get_user_details(username, auth_token)
-                        
-                        last_activity_at = item.get('last_activity_at') or 'N/A'
-                        
-                        # Extract last_activity_editor data correctly
-                        last_activity_editor = item.get('last_activity_editor') or 'N/A'
-                        logging.info(f"Last Activity Editor for {username}: {last_activity_editor}")
-                        
-                        # Split into components if required
-                        parts = last_activity_editor.split('/')
-                        last_active_editor = parts[0] if len(parts) > 0 else 'N/A'
-                        editor_version = parts[1] if len(parts) > 1 else 'N/A'
-                        plugin = parts[2] if len(parts) > 2 else 'N/A'
-                        plugin_version = parts[3] if len(parts) > 3 else 'N/A'
-
-                        # Extract team slug
-                        team_slug = assigning_team.get('slug') or 'N/A'
-                        
-                        users_info.append({
-                            'Username': username or 'N/A', 
-                            'Email': email, 
-                            'Created At': created_at,
-                            'Last Activity At': last_activity_at,
-                            'Last Active Editor': last_active_editor,
-                            'Editor Version': editor_version,
-                            'Plugin': plugin,
-                            'Plugin Version': plugin_version,
-                            'Team Slug': team_slug
-                        })
-                
-                page += 1
-            else:
-                logging.error(f"Error fetching page {page}: {response.status_code} - {response.text}")
-                
-                # Retry for server errors (5xx)
-                if response.status_code >= 500 and retry_count < max_retries:
-                    retry_count += 1
-                    wait_time = 2 ** retry_count  # Exponential backoff
-                    logging.info(f"Retrying in {wait_time} seconds... (Attempt {retry_count} of {max_retries})")
-                    time.sleep(wait_time)
-                else:
-                    break  # Stop the loop if max retries reached or non-retryable error
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request error while fetching billing seats (page {page}): {str(e)}")
-            if retry_count < max_retries:
-                retry_count += 1
-                wait_time = 2 ** retry_count  # Exponential backoff
-                logging.info(f"Retrying in {wait_time} seconds... (Attempt {retry_count} of {max_retries})")
-                time.sleep(wait_time)
-            else:
-                break  # Stop the loop if max retries reached
+            assignee = item.get('assignee')
+            if assignee and assignee.get('login'):
+                matched_seats.append(item)
+
+    # Fetch email and created_at for all matched users
+    logins = list(dict.fromkeys(item['assignee']['login'] for item in matched_seats))
+    user_details = resolve_user_details(session, logins, user_cache, user_cache_ttl_hours,
+                                        user_cache_null_email_ttl_hours)
 
-    return users_info
+    # Per-seat logging is debug-only; check the level once rather than formatting a message per seat
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
 
-def save_to_csv(data, file_path):
+    row_count = 0
+    for item in matched_seats:
+        username = item['assignee']['login']
+        email, created_at = user_details[username]
+        
+        last_activity_at = item.get('last_activity_at') or 'N/A'
+        
+        # Extract last_activity_editor data correctly
+        last_activity_editor = item.get('last_activity_editor') or 'N/A'
+        if debug_enabled:
+            logging.debug(f"Last Activity Editor for {username}: {last_activity_editor}")
+        
+        # Split into at most four components, padding missing ones with 'N/A'
+        parts = (last_activity_editor.split('/', 3) + ['N/A'] * 4)[:4]
+        last_active_editor, editor_version, plugin, plugin_version = parts
+
+        # Extract team slug
+        team_slug = item['assigning_team'].get('slug') or 'N/A'
+        
+        row_count += 1
+        yield (
+            username or 'N/A',
+            email,
+            created_at,
+            last_activity_at,
+            last_active_editor,
+            editor_version,
+            plugin,
+            plugin_version,
+            team_slug
+        )
+
+    logging.info(f"Processed {row_count} Copilot seats across {page_count} pages.")
+
+def save_to_csv(data, compress=False):
     """
-    Save the Copilot billing seats data to a CSV file.
+    Serialize the Copilot billing seats data to CSV in memory.
+    
+    Rows are encoded (and compressed) as they are written, so neither the full
+    row list nor an uncompressed copy of the report is held in memory.
     
     Parameters:
-        data: List of user information dictionaries
-        file_path: The path to save the CSV file
+        data: Iterable of user information rows, in CSV_HEADERS column order
+        compress: Whether to gzip the CSV content
+        
+    Returns:
+        Tuple of the CSV file content as UTF-8 encoded bytes (gzipped if compress is set) and the row count
     """
     try:
-        # Define CSV headers
-        headers = [
-            'Username', 'Email', 'Created At', 'Last Activity At', 
-            'Last Active Editor', 'Editor Version', 'Plugin', 'Plugin Version',
-            'Team Slug'
-        ]
-
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # The report is highly repetitive, so gzip shrinks the upload and the attachment several times over
+        buffer = io.BytesIO()
+        stream = gzip.GzipFile(fileobj=buffer, mode='wb') if compress else buffer
+        text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        writer.writerow(CSV_HEADERS)
+        row_count = 0
+        for row in data:
+            writer.writerow(row)
+            row_count += 1
 
-        # Write data to CSV file
-        with open(file_path, 'w', newline='', encoding='utf-8') as file:
-            writer = csv.DictWriter(file, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(data)
+        # Detach rather than close so the underlying buffer stays readable
+        text.detach()
+        if compress:
+            stream.close()
+        content = buffer.getvalue()
+        logging.info(f"Serialized {row_count} rows to CSV ({len(content)} bytes{', gzipped' if compress else ''})")
 
-        logging.info(f"Data saved to {file_path}")
+        return content, row_count
     except Exception as e:
         logging.error(f"Error saving data to CSV: {str(e)}", exc_info=True)
         raise
 
-def upload_to_blob_storage(connection_string, container_name, local_file_path, blob_name):
+@functools.lru_cache(maxsize=None)
+def get_blob_service_client(connection_string):
+    """
+    Create a BlobServiceClient from a connection string, or with DefaultAzureCredential if none is given.
+    
+    The client is cached for the lifetime of the worker, so warm invocations skip
+    client construction and credential setup.
+    
+    Parameters:
+        connection_string: The Azure Storage connection string
+        
+    Returns:
+        A BlobServiceClient for the storage account
+    """
+    if connection_string:
+        return BlobServiceClient.from_connection_string(connection_string)
+    
+    # Use DefaultAzureCredential with account URL when conn string not available
+    account_name = os.environ.get("STORAGE_ACCOUNT_NAME")
+    if not account_name:
+        raise ValueError("STORAGE_ACCOUNT_NAME environment variable must be set when not using connection string")
+    account_url = f"https://{account_name}.blob.core.windows.net"
+    return BlobServiceClient(account_url=account_url, credential=get_azure_credential())
+
+def upload_to_blob_storage(connection_string, container_name, data, blob_name, content_type='text/csv'):
     """
-    Upload a file to Azure Blob Storage.
+    Upload file content to Azure Blob Storage.
     
     Parameters:
         connection_string: The Azure Storage connection string
         container_name: The name of the blob container
-        local_file_path: The local path to the file to upload
+        data: The file content to upload, as bytes
         blob_name: The name to give the blob in storage
+        content_type: The MIME type stored with the blob
     """
     try:
-        logging.info(f"Uploading {local_file_path} to Blob Storage container '{container_name}' as '{blob_name}'")
+        logging.info(f"Uploading {len(data)} bytes to Blob Storage container '{container_name}' as '{blob_name}'")
         
-        # Create a BlobServiceClient using DefaultAzureCredential if no connection string
-        if connection_string:
-            blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-        else:
-            # Use DefaultAzureCredential with account URL when conn string not available
-            account_name = os.environ.get("STORAGE_ACCOUNT_NAME")
-            if not account_name:
-                raise ValueError("STORAGE_ACCOUNT_NAME environment variable must be set when not using connection string")
-            account_url = f"https://{account_name}.blob.core.windows.net"
-            credential = DefaultAzureCredential()
-            blob_service_client = BlobServiceClient(account_url=account_url, credential=credential)
+        blob_service_client = get_blob_service_client(connection_string)
             
         # Get or create container
         container_client = blob_service_client.get_container_client(container_name)
@@ -419,10 +671,10 @@ def upload_to_blob_storage(connection_string, container_name, local_file_path, b
         except ResourceExistsError:
             logging.info(f"Container '{container_name}' already exists")
         
-        # Upload the file
+        # Upload the file; large reports are split into blocks and uploaded in parallel
         blob_client = container_client.get_blob_client(blob_name)
-        with open(local_file_path, "rb") as data:
-            blob_client.upload_blob(data, overwrite=True)
+        blob_client.upload_blob(data, overwrite=True, length=len(data), max_concurrency=BLOB_UPLOAD_CONCURRENCY,
+                                content_settings=ContentSettings(content_type=content_type))
             
         logging.info(f"File uploaded to Blob Storage successfully: {blob_name}")
         
@@ -436,6 +688,9 @@ def get_email_recipients(connection_string, container_name, email_list_blob_path
     """
     Get the email recipients list from Azure Blob Storage.
     
+    The parsed list is cached at module scope and only downloaded again when the
+    blob's ETag has changed, so warm invocations skip the download and JSON parse.
+    
     Parameters:
         connection_string: The Azure Storage connection string
         container_name: The name of the blob container
@@ -447,29 +702,29 @@ def get_email_recipients(connection_string, container_name, email_list_blob_path
     try:
         logging.info(f"Getting email recipients from Blob Storage: {email_list_blob_path}")
         
-        # Create a BlobServiceClient
-        if connection_string:
-            blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-        else:
-            # Use DefaultAzureCredential with account URL when conn string not available
-            account_name = os.environ.get("STORAGE_ACCOUNT_NAME")
-            if not account_name:
-                raise ValueError("STORAGE_ACCOUNT_NAME environment variable must be set when not using connection string")
-            account_url = f"https://{account_name}.blob.core.windows.net"
-            credential = DefaultAzureCredential()
-            blob_service_client = BlobServiceClient(account_url=account_url, credential=credential)
+        blob_service_client = get_blob_service_client(connection_string)
             
         # Get container client
         container_client = blob_service_client.get_container_client(container_name)
         
-        # Get blob client and download blob
+        # Get blob client and download blob, unless the cached copy is still current
         blob_client = container_client.get_blob_client(email_list_blob_path)
-        download_stream = blob_client.download_blob()
+        cache_key = (container_name, email_list_blob_path)
+        cached = EMAIL_RECIPIENTS_CACHE.get(cache_key)
+        try:
+            if cached:
+                download_stream = blob_client.download_blob(etag=cached['etag'], match_condition=MatchConditions.IfModified)
+            else:
+                download_stream = blob_client.download_blob()
+        except ResourceNotModifiedError:
+            logging.info("Email list unchanged, using cached recipients")
+            return cached['emails']
         
         # Parse JSON content
-        email_data = json.loads(download_stream.readall().decode('utf-8'))
+        email_data = parse_json(download_stream.readall())
         
         if 'emails' in email_data and isinstance(email_data['emails'], list):
+            EMAIL_RECIPIENTS_CACHE[cache_key] = {'etag': download_stream.properties.etag, 'emails': email_data['emails']}
             return email_data['emails']
         else:
             logging.warning("Email list JSON does not contain expected 'emails' array")
@@ -479,9 +734,129 @@ def get_email_recipients(connection_string, container_name, email_list_blob_path
         # Fall back to a default list or empty list in case of error
         return []
 
+def load_user_cache(connection_string, container_name, user_cache_blob_path):
+    """
+    Load the user details cache written by previous runs from Azure Blob Storage.
+    
+    Parameters:
+        connection_string: The Azure Storage connection string
+        container_name: The name of the blob container
+        user_cache_blob_path: The path to the blob containing the user cache JSON
+        
+    Returns:
+        Dictionary mapping username to its cached email, created_at and fetched_at values
+    """
+    try:
+        logging.info(f"Loading user cache from Blob Storage: {user_cache_blob_path}")
+        
+        blob_service_client = get_blob_service_client(connection_string)
+        blob_client = blob_service_client.get_blob_client(container_name, user_cache_blob_path)
+        user_cache = parse_json(blob_client.download_blob().readall())
+        
+        logging.info(f"Loaded {len(user_cache)} cached users")
+        return user_cache
+    except ResourceNotFoundError:
+        logging.info("No user cache found, starting with an empty cache")
+        return {}
+    except Exception as e:
+        logging.error(f"Error loading user cache: {str(e)}", exc_info=True)
+        # A missing cache only costs extra API calls, so continue without it
+        return {}
+
+def save_user_cache(connection_string, container_name, user_cache_blob_path, user_cache, max_age_hours=720):
+    """
+    Save the user details cache to Azure Blob Storage for the next run.
+    
+    Entries older than max_age_hours could no longer be served under any TTL, so they
+    are dropped; users who left the enterprise do not stay in the cache forever.
+    
+    Parameters:
+        connection_string: The Azure Storage connection string
+        container_name: The name of the blob container
+        user_cache_blob_path: The path to the blob containing the user cache JSON
+        user_cache: Dictionary mapping username to its cached details
+        max_age_hours: Age, in hours, past which a cached entry is dropped
+    """
+    try:
+        cutoff = datetime.now() - timedelta(hours=max_age_hours)
+        user_cache = {login: entry for login, entry in user_cache.items()
+                      if datetime.fromisoformat(entry['fetched_at']) >= cutoff}
+        
+        blob_service_client = get_blob_service_client(connection_string)
+        blob_client = blob_service_client.get_blob_client(container_name, user_cache_blob_path)
+        blob_client.upload_blob(dump_json(user_cache), overwrite=True)
+        
+        logging.info(f"Saved {len(user_cache)} users to cache: {user_cache_blob_path}")
+    except Exception as e:
+        logging.error(f"Error saving user cache: {str(e)}", exc_info=True)
+
+def load_response_cache(connection_string, container_name, response_cache_blob_path):
+    """
+    Load the ETags and bodies of GitHub pages fetched by previous runs from Azure Blob Storage.
+    
+    Parameters:
+        connection_string: The Azure Storage connection string
+        container_name: The name of the blob container
+        response_cache_blob_path: The path to the blob containing the response cache JSON
+        
+    Returns:
+        ResponseCache mapping page URL to its cached etag, body and Link header URLs
+    """
+    try:
+        logging.info(f"Loading response cache from Blob Storage: {response_cache_blob_path}")
+        
+        blob_service_client = get_blob_service_client(connection_string)
+        blob_client = blob_service_client.get_blob_client(container_name, response_cache_blob_path)
+        response_cache = ResponseCache(parse_json(blob_client.download_blob().readall()))
+        
+        logging.info(f"Loaded {len(response_cache)} cached responses")
+        return response_cache
+    except ResourceNotFoundError:
+        logging.info("No response cache found, starting with an empty cache")
+        return ResponseCache()
+    except Exception as e:
+        logging.error(f"Error loading response cache: {str(e)}", exc_info=True)
+        # Without the cache every page is simply fetched in full
+        return ResponseCache()
+
+def save_response_cache(connection_string, container_name, response_cache_blob_path, response_cache):
+    """
+    Save the ETags and bodies of the fetched GitHub pages to Azure Blob Storage for the next run.
+    
+    Only the pages requested this run are saved, so pages that no longer exist are evicted.
+    
+    Parameters:
+        connection_string: The Azure Storage connection string
+        container_name: The name of the blob container
+        response_cache_blob_path: The path to the blob containing the response cache JSON
+        response_cache: ResponseCache of the pages fetched this run
+    """
+    try:
+        entries = response_cache.fetched_entries()
+        blob_service_client = get_blob_service_client(connection_string)
+        blob_client = blob_service_client.get_blob_client(container_name, response_cache_blob_path)
+        blob_client.upload_blob(dump_json(entries), overwrite=True)
+        
+        logging.info(f"Saved {len(entries)} responses to cache: {response_cache_blob_path}")
+    except Exception as e:
+        logging.error(f"Error saving response cache: {str(e)}", exc_info=True)
+
+@functools.lru_cache(maxsize=None)
+def get_email_client(communication_service_connection_string):
+    """
+    Create an Azure Communication Services EmailClient, cached for the lifetime of the worker.
+    
+    Parameters:
+        communication_service_connection_string: Azure Communication Services connection string
+        
+    Returns:
+        An EmailClient for the Communication Services resource
+    """
+    return EmailClient.from_connection_string(communication_service_connection_string)
+
 def send_email(connection_string, container_name, email_list_blob_path, 
                communication_service_connection_string, sender_email,
-               report_file_path, report_filename):
+               report_content, report_filename, content_type='text/csv'):
     """
     Send email with the Copilot billing seats report attached.
     
@@ -491,8 +866,9 @@ def send_email(connection_string, container_name, email_list_blob_path,
         email_list_blob_path: Path to the blob with email recipients
         communication_service_connection_string: Azure Communication Services connection string
         sender_email: Email address to send from
-        report_file_path: Local path to the report file
+        report_content: Content of the report file, as bytes
         report_filename: Filename of the report
+        content_type: MIME type of the report attachment
     """
     try:
         logging.info("Preparing to send email report")
@@ -506,13 +882,9 @@ def send_email(connection_string, container_name, email_list_blob_path,
             
         logging.info(f"Sending email to {len(recipients)} recipients")
         
-        # Create email client
-        email_client = EmailClient.from_connection_string(communication_service_connection_string)
+        # Get email client
+        email_client = get_email_client(communication_service_connection_string)
         
-        # Read the report file
-        with open(report_file_path, 'rb') as file:
-            file_content = file.read()
-            
         # Prepare email content
         subject = f"Copilot Report - {datetime.now().strftime('%Y-%m-%d')}"
         content = """
@@ -525,27 +897,57 @@ def send_email(connection_string, container_name, email_list_blob_path,
         </html>
         """
         
-        # Send email to all recipients
-        poller = email_client.begin_send(
-            sender=sender_email,
-            recipients_to=recipients,
-            subject=subject,
-            html_content=content,
-            attachments=[
-                {
-                    "name": report_filename,
-                    "content_type": "text/csv",
-                    "content_bytes": file_content
-                }
-            ]
-        )
-        
-        # Wait for the operation to complete
-        result = poller.result()
+        # The attachment is built once and shared by every batch
+        attachments = [
+            {
+                "name": report_filename,
+                "content_type": content_type,
+                "content_bytes": report_content
+            }
+        ]
         
-        logging.info(f"Email sent successfully. Message ID: {result.message_id}")
+        # Send to the recipients in batches, in parallel; a failed batch does not stop the others
+        batches = [recipients[i:i + EMAIL_RECIPIENT_BATCH_SIZE]
+                   for i in range(0, len(recipients), EMAIL_RECIPIENT_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=min(len(batches), EMAIL_SEND_CONCURRENCY)) as executor:
+            futures = [
+                executor.submit(send_email_batch, email_client, sender_email, batch, subject, content, attachments)
+                for batch in batches
+            ]
+            for batch_number, future in enumerate(futures, 1):
+                try:
+                    result = future.result()
+                    logging.info(f"Email batch {batch_number} of {len(batches)} sent successfully. Message ID: {result.message_id}")
+                except Exception as e:
+                    logging.error(f"Error sending email batch {batch_number} of {len(batches)}: {str(e)}", exc_info=True)
         
     except Exception as e:
         logging.error(f"Error sending email: {str(e)}", exc_info=True)
         # In a production environment, we would want to alert on email failures
         # Here we could add application insights or other monitoring
+
+def send_email_batch(email_client, sender_email, recipients, subject, content, attachments):
+    """
+    Send the report email to one batch of recipients and wait for the send to complete.
+    
+    Parameters:
+        email_client: The Azure Communication Services EmailClient
+        sender_email: Email address to send from
+        recipients: The batch of recipient email addresses
+        subject: The email subject
+        content: The HTML body of the email
+        attachments: The email attachments
+        
+    Returns:
+        The result of the send operation
+    """
+    poller = email_client.begin_send(
+        sender=sender_email,
+        recipients_to=recipients,
+        subject=subject,
+        html_content=content,
+        attachments=attachments
+    )
+    
+    # Wait for the operation to complete
+    return poller.result()
@@ -1,11 +1,12 @@
 import requests
 import csv
 import logging
-import time
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 from dotenv import load_dotenv
 import os
+from concurrent.futures import ThreadPoolExecutor
+from github_http import ResponseCache, conditional_get, dump_json, parse_json
 
 # Load environment variables
 load_dotenv()
@@ -18,10 +19,17 @@ if not personal_access_token:
     logging.error("GitHub personal access token is missing. Please check the .env file.")
     raise ValueError("GitHub personal access token is missing. Please check the .env file.")
 
-# Setup for resilient HTTP requests
+# Maximum number of organizations processed concurrently, kept low to stay under secondary rate limits
+ORG_WORKERS = 4
+
+# Maximum number of teams whose members are fetched concurrently, per organization
+TEAM_MEMBER_WORKERS = 10
+
+# Setup for resilient HTTP requests, with a connection pool large enough for all the worker threads
+# Connection errors are retried here; error statuses (even with Retry-After) are retried only by github_request
 session = requests.Session()
-retry = Retry(total=5, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504])
-adapter = HTTPAdapter(max_retries=retry)
+retry = Retry(total=5, backoff_factor=0.1, respect_retry_after_header=False, raise_on_status=False)
+adapter = HTTPAdapter(max_retries=retry, pool_maxsize=ORG_WORKERS * TEAM_MEMBER_WORKERS)
 session.mount('http://', adapter)
 session.mount('https://', adapter)
 
@@ -38,22 +46,52 @@ elif test_response.status_code != 200:
 # Set up logging
 logging.basicConfig(filename='debug.log', level=logging.DEBUG)
 
+# Load the ETags and bodies of the pages fetched by the previous run, so unchanged pages come back as 304s
+ETAG_CACHE_FILE = 'etag_cache.json'
+try:
+    with open(ETAG_CACHE_FILE, 'rb') as cache_file:
+        response_cache = ResponseCache(parse_json(cache_file.read()))
+except (FileNotFoundError, ValueError):
+    response_cache = ResponseCache()
+
 # Update headers to include team information
 headers = ["Organization", "Username", "Email", "Created At", "Last Activity At", "Pending Cancellation Date", "Team Name"]
 
+# Helper function to fetch every page of members for a single team
+def _fetch_all_members(org_name, team_slug, session, headers):
+    logins = []
+    members_url = f"https://api.github.com/orgs/{org_name}/teams/{team_slug}/members"
+    members_page = 1
+    while True:
+        paged_members_url = f"{members_url}?per_page=100&page={members_page}"
+        members_response, body, _ = conditional_get(session, paged_members_url, response_cache, headers=headers)
+        if members_response.status_code not in (200, 304):
+            break
+        members = parse_json(body)
+        if not members:
+            break
+        for member in members:
+            login = member.get("login")
+            if login:
+                logins.append(login)
+        members_page += 1
+    return logins
+
 # Helper function to get all teams and build user-to-teams mapping
 # Updated: fetch all teams, not just those with 'copilot' in the name or slug
+# Team members are fetched concurrently; results are merged in team order so the report stays stable
 def get_user_teams(org_name, session, token):
     user_teams = {}
     teams_url = f"https://api.github.com/orgs/{org_name}/teams"
     headers = {"Authorization": f"Bearer {token}", "Accept": "application/vnd.github+json"}
+    org_teams = []
     page = 1
     while True:
         paged_teams_url = f"{teams_url}?per_page=100&page={page}"
-        teams_response = session.get(paged_teams_url, headers=headers)
-        if teams_response.status_code != 200:
+        teams_response, body, _ = conditional_get(session, paged_teams_url, response_cache, headers=headers)
+        if teams_response.status_code not in (200, 304):
             break
-        teams = teams_response.json()
+        teams = parse_json(body)
         if not teams:
             break
         for team in teams:
@@ -61,66 +99,81 @@ def get_user_teams(org_name, session, token):
             team_slug = team.get("slug", "").lower()
             if not team_slug:
                 continue
-            members_url = f"https://api.github.com/orgs/{org_name}/teams/{team_slug}/members"
-            members_page = 1
-            while True:
-                paged_members_url = f"{members_url}?per_page=100&page={members_page}"
-                members_response = session.get(paged_members_url, headers=headers)
-                if members_response.status_code != 200:
-                    break
-                members = members_response.json()
-                if not members:
-                    break
-                for member in members:
-                    login = member.get("login")
-                    if login:
-                        user_teams.setdefault(login, []).append(team_name)
-                members_page += 1
+            org_teams.append((team_name, team_slug))
         page += 1
+
+    with ThreadPoolExecutor(max_workers=TEAM_MEMBER_WORKERS) as executor:
+        team_members = executor.map(lambda team: _fetch_all_members(org_name, team[1], session, headers), org_teams)
+        for (team_name, _), logins in zip(org_teams, team_members):
+            for login in logins:
+                user_teams.setdefault(login, []).append(team_name)
     return user_teams
 
+# Helper function to collect the report rows for one organization
+def process_org(org_name):
+    logging.debug(f'Processing organization: {org_name}')
+    print(f'Processing organization: {org_name}')
+    rows = []
+
+    # Build user-to-teams mapping for the org
+    user_teams_map = get_user_teams(org_name, session, personal_access_token)
+
+    # Fetch Copilot seat assignments, following the Link header's next page until every seat is read
+    url = f"https://api.github.com/orgs/{org_name}/copilot/billing/seats?per_page=100"
+    seat_count = 0
+    total_seats = None
+    while url:
+        seats_response, seats_body, links = conditional_get(session, url, response_cache,
+                                                            headers={"Authorization": f"Bearer {personal_access_token}", "Accept": "application/vnd.github+json"})
+        if seats_response.status_code not in (200, 304):
+            logging.error(f"Failed to fetch seat information for {org_name}: {seats_response.status_code} - {seats_response.text}")
+            break
+        seats_data = parse_json(seats_body)
+        if "seats" not in seats_data:
+            logging.warning(f"No seat data found for organization: {org_name}")
+            break
+        total_seats = seats_data.get("total_seats", total_seats)
+        for seat in seats_data["seats"]:
+            username = seat.get("assignee", {}).get("login", "N/A")
+            email = seat.get("assignee", {}).get("email", "N/A")
+            created_at = seat.get("created_at", "N/A")
+            last_activity_at = seat.get("last_activity_at", "N/A")
+            pending_cancellation_date = seat.get("pending_cancellation_date", "N/A")
+
+            # Get team names from user_teams_map with a single lookup
+            user_team_names = user_teams_map.get(username)
+            team_names = ", ".join(user_team_names) if user_team_names else "null"
+
+            rows.append((org_name, username, email, created_at, last_activity_at, pending_cancellation_date, team_names))
+            seat_count += 1
+            logging.debug(f'Collected seat data for user: {username}, team: {team_names}')
+        url = links.get('next')
+
+    if total_seats is not None and seat_count < total_seats:
+        logging.warning(f"Collected {seat_count} of {total_seats} seats for organization: {org_name}")
+    return rows
+
+# Read the organizations from the file
+org_names = []
+with open('orgs.csv', 'r') as orgs_file:
+    for line in orgs_file:
+        org_name = line.strip()
+        if not org_name:
+            logging.warning("Empty organization name found in orgs.csv. Skipping...")
+            continue
+        org_names.append(org_name)
+
 # Open the CSV file for writing data
+# Organizations are processed concurrently; rows are written here, in orgs.csv order, by this thread alone
 with open('copilot-seat-analysis.csv', 'w', newline='') as file:
     writer = csv.writer(file)
     writer.writerow(headers)
 
-    # Read the organizations from the file
-    with open('orgs.csv', 'r') as orgs_file:
-        for line in orgs_file:
-            org_name = line.strip()
-            if not org_name:
-                logging.warning("Empty organization name found in orgs.csv. Skipping...")
-                continue
+    with ThreadPoolExecutor(max_workers=ORG_WORKERS) as executor:
+        for org_name, rows in zip(org_names, executor.map(process_org, org_names)):
+            writer.writerows(rows)
+            logging.debug(f'Wrote {len(rows)} seats for organization: {org_name}')
 
-            logging.debug(f'Processing organization: {org_name}')
-            print(f'Processing organization: {org_name}')
-
-            # Build user-to-teams mapping for the org
-            user_teams_map = get_user_teams(org_name, session, personal_access_token)
-
-            # Fetch Copilot seat assignments
-            seats_response = session.get(f"https://api.github.com/orgs/{org_name}/copilot/billing/seats",
-                                         headers={"Authorization": f"Bearer {personal_access_token}", "Accept": "application/vnd.github+json"})
-            if seats_response.status_code == 200:
-                seats_data = seats_response.json()
-                if "seats" in seats_data:
-                    for seat in seats_data["seats"]:
-                        username = seat.get("assignee", {}).get("login", "N/A")
-                        email = seat.get("assignee", {}).get("email", "N/A")
-                        created_at = seat.get("created_at", "N/A")
-                        last_activity_at = seat.get("last_activity_at", "N/A")
-                        pending_cancellation_date = seat.get("pending_cancellation_date", "N/A")
-
-                        # Get team names from user_teams_map
-                        team_names = ", ".join(user_teams_map.get(username, [])) if username in user_teams_map else "null"
-
-                        writer.writerow([org_name, username, email, created_at, seat.get("last_activity_at", "N/A"), seat.get("pending_cancellation_date", "N/A"), team_names])
-                        logging.debug(f'Wrote seat data for user: {username}, team: {team_names}')
-                else:
-                    logging.warning(f"No seat data found for organization: {org_name}")
-            else:
-                logging.error(f"Failed to fetch seat information for {org_name}: {seats_response.status_code} - {seats_response.text}")
-
-            logging.debug('Waiting for 30 seconds before processing the next organization...')
-            print('Waiting for 30 seconds before processing the next organization...')
-            time.sleep(30)
\ No newline at end of file
+# Save the ETags and bodies for the next run; pages not requested this run are dropped
+with open(ETAG_CACHE_FILE, 'wb') as cache_file:
+    cache_file.write(dump_json(response_cache.fetched_entries()))
\ No newline at end of file
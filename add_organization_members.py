@@ -1,44 +1,32 @@
-import requests
-import time
+import os
+from membership import run, setup_logging
 
-def add_organization_member(username, api_token):
-    # API endpoint
-    base_url = "https://api.github.com/orgs/<orgname>/memberships/"
-    url = f"{base_url}{username}"
+# Membership endpoint and the role each handle is given
+URL_TEMPLATE = "https://api.github.com/orgs/{org}/memberships/{user}"
+ROLE = "member"
 
-    # Headers
-    headers = {
-        "Accept": "application/vnd.github+json",
-        "Authorization": f"Bearer {api_token}",
-        "X-GitHub-Api-Version": "2022-11-28"
-    }
+# Handles that still failed after retrying are written here, so they can be fed back in as handles.txt
+FAILED_HANDLES_FILE = 'failed_organization_members.txt'
 
-    # Request body
-    data = {
-        "role": "member"
-    }
-
-    try:
-        response = requests.put(url, headers=headers, json=data)
-        print(f"Adding {username}: {response.status_code}")
-        if response.status_code != 200:
-            print(f"Error: {response.json()}")
-        time.sleep(1)  # Rate limiting - wait 1 second between requests
-    except Exception as e:
-        print(f"Error adding {username}: {str(e)}")
+# ETags of memberships already found in the desired state, so re-runs can skip them with a conditional GET
+STATE_FILE = 'organization_members_state.json'
 
 def main():
-    # Replace with your GitHub API token
-    api_token = "put the token here"
+    # GitHub API token (a personal access token or a GitHub App installation token), read once from the environment
+    api_token = os.environ.get("GITHUB_TOKEN")
+    if not api_token:
+        raise SystemExit("Set GITHUB_TOKEN to a GitHub API token")
 
-    # Read handles from file
-    with open('handles.txt', 'r') as file:
-        handles = [line.strip() for line in file if line.strip()]
+    # Organization to add the handles to
+    org = os.environ.get("GITHUB_ORG")
+    if not org:
+        raise SystemExit("Set GITHUB_ORG to the organization name")
 
-    # Process each handle
-    for handle in handles:
-        print(f"Processing handle: {handle}")
-        add_organization_member(handle, api_token)
+    run(api_token, lambda user: URL_TEMPLATE.format(org=org, user=user), ROLE, STATE_FILE, FAILED_HANDLES_FILE)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    log_listener = setup_logging()
+    try:
+        main()
+    finally:
+        log_listener.stop()
\ No newline at end of file
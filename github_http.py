@@ -0,0 +1,374 @@
+import json
+import logging
+import random
+import threading
+import time
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional; the standard library parser is used when it is not installed
+    orjson = None
+
+# Below this many remaining requests, calls are paced evenly over the rest of the rate-limit window
+RATE_LIMIT_THROTTLE_THRESHOLD = 100
+
+# How many times a rate-limited or failed request is retried
+MAX_RETRIES = 5
+
+# Server errors retried with full-jitter exponential backoff
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+RETRY_BACKOFF_BASE = 1
+RETRY_BACKOFF_MAX = 60
+
+# Upper bound, in seconds, on the total time spent retrying one request
+RETRY_MAX_ELAPSED = 300
+
+# Earliest monotonic time at which the next throttled request may go out, shared by
+# every thread in the process so the pacing applies to the run as a whole
+_throttle_lock = threading.Lock()
+_throttle_next_allowed = 0.0
+
+def parse_json(content):
+    """
+    Parse a JSON response body, using orjson when it is installed.
+    
+    Parameters:
+        content: The raw response body, as bytes or str
+        
+    Returns:
+        The parsed JSON value
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def dump_json(value):
+    """
+    Serialize a value to UTF-8 encoded JSON, using orjson when it is installed.
+    
+    Parameters:
+        value: The JSON-serializable value
+        
+    Returns:
+        The JSON document as bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value).encode('utf-8')
+
+def github_request(session, method, url, **kwargs):
+    """
+    Send a GitHub API request through the session with rate-limit and retry handling.
+    
+    The primary rate limit is paced by check_rate_limit. A 403 or 429 secondary
+    rate-limit response is retried after its Retry-After delay. Server errors, and
+    429s without a Retry-After, are retried after a random delay of up to
+    RETRY_BACKOFF_BASE * 2**attempt seconds (full jitter), so parallel workers and
+    function instances do not retry in lockstep. Retries stop after MAX_RETRIES
+    attempts or once the next wait would pass RETRY_MAX_ELAPSED seconds.
+    
+    Parameters:
+        session: The GitHub API session
+        method: The HTTP method
+        url: The request URL
+        **kwargs: Additional arguments passed to requests.Session.request
+        
+    Returns:
+        The final requests.Response
+    """
+    deadline = time.monotonic() + RETRY_MAX_ELAPSED
+    for attempt in range(MAX_RETRIES + 1):
+        response = session.request(method, url, **kwargs)
+        
+        # Check for rate limiting
+        check_rate_limit(response.headers)
+        
+        delay = retry_delay(response, attempt)
+        if delay is None or attempt == MAX_RETRIES:
+            return response
+        if time.monotonic() + delay > deadline:
+            logging.warning(f"Giving up on {url} after {attempt + 1} attempts: status {response.status_code}")
+            return response
+        
+        logging.warning(f"Request to {url} returned {response.status_code}. Retrying in {delay:.1f} seconds... (Attempt {attempt + 1} of {MAX_RETRIES})")
+        time.sleep(delay)
+    
+    return response
+
+def retry_delay(response, attempt):
+    """
+    Work out how long to wait before retrying a response.
+    
+    Parameters:
+        response: The requests.Response to inspect
+        attempt: The zero-based number of the attempt that produced the response
+        
+    Returns:
+        The delay in seconds, or None if the response should not be retried
+    """
+    status = response.status_code
+    if status in (403, 429):
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is not None and retry_after.isdigit():
+            return int(retry_after)
+        # Retry without a delay of its own: the caller must wait for the reset first, as
+        # github_request does through check_rate_limit and the membership PUT loop through
+        # RateLimitTracker.wait() at the top of its next attempt
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            return 0
+        if status == 403:
+            # A plain 403 is a permissions error, not a rate limit
+            return None
+    elif status not in RETRY_STATUSES:
+        return None
+    
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+def check_rate_limit(headers):
+    """
+    Check and handle GitHub API rate limiting.
+    
+    When the limit is exhausted this waits for the reset. Once fewer than
+    RATE_LIMIT_THROTTLE_THRESHOLD requests remain, calls are instead given evenly
+    spaced slots over the time left, so the remaining budget is spread over the
+    window rather than hitting the limit and stalling until the reset. The slots
+    are shared process-wide, so parallel threads do not spend the budget faster.
+    
+    Parameters:
+        headers: The HTTP response headers from a GitHub API request
+    """
+    global _throttle_next_allowed
+    if 'X-RateLimit-Remaining' not in headers:
+        return
+    
+    remaining = int(headers['X-RateLimit-Remaining'])
+    reset_time = int(headers.get('X-RateLimit-Reset', 0))
+    wait_time = max(reset_time - time.time(), 0)
+    
+    if remaining >= RATE_LIMIT_THROTTLE_THRESHOLD:
+        return
+    
+    now = time.monotonic()
+    with _throttle_lock:
+        if remaining == 0:
+            # Hold every thread until the reset time plus a buffer
+            _throttle_next_allowed = max(_throttle_next_allowed, now + wait_time + 1)
+            slot = _throttle_next_allowed
+        else:
+            # Take the next free slot, one even share of the time left after the previous one
+            slot = max(now, _throttle_next_allowed)
+            _throttle_next_allowed = slot + wait_time / remaining
+    
+    delay = slot - now
+    if remaining == 0:
+        logging.warning(f"Rate limit reached. Waiting for {delay:.0f} seconds.")
+    elif delay > 0:
+        logging.info(f"{remaining} requests left before the rate limit resets. Throttling for {delay:.1f} seconds.")
+    if delay > 0:
+        time.sleep(delay)
+
+def conditional_get(session, url, response_cache, **kwargs):
+    """
+    GET a GitHub API URL, revalidating a previously cached response with its ETag.
+    
+    A 304 Not Modified reply carries no body and does not count against the primary
+    rate limit, so pages that have not changed since the last run cost almost nothing.
+    
+    Parameters:
+        session: The GitHub API session
+        url: The request URL
+        response_cache: ResponseCache mapping URL to its cached etag, body and Link header URLs, updated in place
+        **kwargs: Additional arguments passed to requests.Session.request
+        
+    Returns:
+        Tuple of the requests.Response, the response body and a dictionary of Link
+        header URLs keyed by rel. For a 304 the body and links come from the cache.
+    """
+    response_cache.fetched.add(url)
+    cached = response_cache.get(url)
+    if cached:
+        kwargs['headers'] = {**(kwargs.get('headers') or {}), 'If-None-Match': cached['etag']}
+    
+    response = github_request(session, 'GET', url, **kwargs)
+    if cached and response.status_code == 304:
+        return response, cached['body'], cached.get('links', {})
+    
+    links = {rel: link['url'] for rel, link in response.links.items()}
+    etag = response.headers.get('ETag')
+    if response.status_code == 200 and etag:
+        response_cache[url] = {'etag': etag, 'body': response.text, 'links': links}
+    return response, response.content, links
+
+class ResponseCache(dict):
+    """
+    ETag cache of GitHub responses, mapping URL to its etag, body and Link header URLs.
+    
+    conditional_get records every URL it requests, so only the entries for pages
+    requested this run are saved again. Pages that no longer exist drop out of the cache
+    instead of being kept forever.
+    """
+    def __init__(self, entries=None):
+        super().__init__(entries or {})
+        self.fetched = set()
+    
+    def fetched_entries(self):
+        """
+        Returns:
+            Dictionary of the cached entries for the URLs requested this run
+        """
+        return {url: entry for url, entry in self.items() if url in self.fetched}
+
+class RateLimiter:
+    """
+    Thread-safe token bucket allowing max_rate calls per time_period seconds.
+    
+    Calls under the limit go through immediately. Once the bucket is empty, acquire
+    blocks until a token has refilled, so throughput follows the configured rate
+    rather than a fixed sleep per call. Use an instance as a context manager around
+    each request.
+    """
+    def __init__(self, max_rate, time_period=60):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._tokens = max_rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take one token, waiting for the bucket to refill if it is empty.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                refill = (now - self._updated) * self.max_rate / self.time_period
+                self._tokens = min(self.max_rate, self._tokens + refill)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * self.time_period / self.max_rate
+            time.sleep(wait)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+class RateLimitTracker:
+    """
+    Shares GitHub rate-limit state between worker threads so they pause together.
+    
+    Each worker calls wait before a request and update with the response. A 403/429
+    with Retry-After, or a primary limit down to the last threshold share of its
+    budget, pauses every worker until the delay or the reset has passed, instead of
+    letting the other workers keep spending requests in the meantime.
+    """
+    def __init__(self, threshold=0.1):
+        self.threshold = threshold
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until any pause requested by a worker is over.
+        """
+        while True:
+            with self._lock:
+                delay = self._resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def update(self, response):
+        """
+        Record the rate-limit headers of a response, pausing every worker when needed.
+        
+        Parameters:
+            response: The requests.Response of a GitHub API request
+        """
+        headers = response.headers
+        delay = 0
+        retry_after = headers.get('Retry-After')
+        if response.status_code in (403, 429) and retry_after is not None and retry_after.isdigit():
+            delay = int(retry_after)
+            logging.warning(f"Secondary rate limit hit. Pausing all requests for {delay} seconds.")
+        elif 'X-RateLimit-Remaining' in headers:
+            remaining = int(headers['X-RateLimit-Remaining'])
+            limit = int(headers.get('X-RateLimit-Limit', 0))
+            if remaining == 0 or remaining < limit * self.threshold:
+                delay = max(int(headers.get('X-RateLimit-Reset', 0)) - time.time(), 0) + 1
+                logging.warning(f"{remaining} requests left before the rate limit resets. Pausing all requests for {delay:.0f} seconds.")
+        
+        if delay > 0:
+            with self._lock:
+                self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Caps in-flight requests with an AIMD (additive-increase, multiplicative-decrease) limit.
+    
+    While the moving average latency stays at or under target_latency, the limit grows
+    by about one permit per round of successful requests. A slow average, an error
+    status or an exception halves it. The limit always stays within
+    [min_limit, max_limit]. Use an instance as a context manager around each request
+    and call record with the request's latency and outcome.
+    """
+    def __init__(self, min_limit=1, max_limit=20, target_latency=1.0, window=20, initial_limit=None):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        # Smoothing factor of an exponential moving average spanning roughly `window` samples
+        self._alpha = 2 / (window + 1)
+        self._limit = float(initial_limit or max(min_limit, max_limit // 2))
+        self._latency = None
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        """
+        The current number of requests allowed in flight.
+        """
+        return int(self._limit)
+
+    def record(self, latency, success=True):
+        """
+        Feed one request's outcome into the limit.
+        
+        Parameters:
+            latency: How long the request took, in seconds
+            success: Whether the request succeeded rather than hit a retryable error
+        """
+        with self._condition:
+            if self._latency is None:
+                self._latency = latency
+            else:
+                self._latency = self._alpha * latency + (1 - self._alpha) * self._latency
+            
+            if success and self._latency <= self.target_latency:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            else:
+                self._decrease()
+            self._condition.notify_all()
+
+    def _decrease(self):
+        self._limit = max(self.min_limit, self._limit / 2)
+
+    def __enter__(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._condition:
+            self._in_flight -= 1
+            if exc_type is not None:
+                self._decrease()
+            self._condition.notify_all()
+        return False
@@ -0,0 +1,197 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from github_http import MAX_RETRIES, AdaptiveConcurrencyLimiter, RateLimiter, RateLimitTracker, retry_delay
+
+# Shared by add_team_members.py and add_organization_members.py, which only supply the
+# membership endpoint, role, output files and environment variables
+
+# Most membership requests in flight at once; tune with GH_CONCURRENCY against observed 429s
+# Within this cap the actual concurrency adapts to GitHub's latency and error rate
+MAX_WORKERS = int(os.environ.get('GH_CONCURRENCY', '10'))
+
+# GitHub login format, plus the underscore used by Enterprise Managed User handles (shortcode_enterprise)
+LOGIN_PATTERN = re.compile(r"^[A-Za-z0-9](?:[A-Za-z0-9_]|-(?=[A-Za-z0-9_])){0,38}$")
+
+# Handles read ahead of the workers; bounded so the file is only read as fast as they keep up
+HANDLE_QUEUE_SIZE = 4096
+
+# Average request latency, in seconds, above which concurrency is reduced
+TARGET_LATENCY = 1.0
+
+# Membership changes allowed per minute, kept below GitHub's secondary rate limit for write requests
+REQUESTS_PER_MINUTE = 30
+
+# Checks whether a previous run already saw this membership with the requested role;
+# a 304 on the conditional GET does not count against the primary rate limit
+def membership_is_current(username, url, role, session, tracker, state):
+    cached = state.get(username)
+    headers = {"If-None-Match": cached["etag"]} if cached else None
+
+    tracker.wait()
+    response = session.get(url, headers=headers)
+    tracker.update(response)
+
+    if cached and response.status_code == 304:
+        return True
+    if response.status_code == 200 and response.json().get("role") == role:
+        etag = response.headers.get("ETag")
+        if etag:
+            state[username] = {"etag": etag, "last_status": response.status_code}
+        return True
+
+    # Not a member yet (404) or a different role, so the PUT is needed
+    state.pop(username, None)
+    return False
+
+# Sets the membership with a PUT of the serialized role body, unless it is already current
+def add_member(username, url, role, body, session, limiter, tracker, concurrency, state):
+    try:
+        if membership_is_current(username, url, role, session, tracker, state):
+            logging.info("user=%s status=current", username)
+            return True
+
+        for attempt in range(MAX_RETRIES + 1):
+            tracker.wait()
+            with limiter, concurrency:
+                started = time.monotonic()
+                response = session.put(url, data=body)
+                # Same retry policy as github_request: secondary rate limits (403 or 429) and server errors
+                delay = retry_delay(response, attempt)
+                concurrency.record(time.monotonic() - started, delay is None)
+            # A rate-limited response pauses every worker until its Retry-After or reset time
+            tracker.update(response)
+            if delay is None or attempt == MAX_RETRIES:
+                break
+
+            logging.warning("user=%s status=%d retry_in=%.1f", username, response.status_code, delay)
+            time.sleep(delay)
+
+        # The endpoint returns 200 for an updated membership and 201 for a new one
+        if response.status_code not in (200, 201):
+            try:
+                error = response.json()
+            except ValueError:
+                # 5xx error pages are not always JSON
+                error = response.text
+            logging.error("user=%s status=%d error=%s", username, response.status_code, error)
+            return False
+        logging.info("user=%s status=%d", username, response.status_code)
+        return True
+    except Exception as e:
+        logging.error("user=%s error=%s", username, e)
+        return False
+
+# Sets up logging through a queue: workers only enqueue records, and a background
+# listener thread formats and writes them, so no worker blocks on stderr
+def setup_logging():
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    log_queue = queue.Queue()
+    # The queue handler passes the bare message on; the listener's handler adds the timestamp and level
+    logging.basicConfig(level=logging.INFO, format='%(message)s', handlers=[logging.handlers.QueueHandler(log_queue)])
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+# Yields the unique, well-formed handles in the file one at a time, without loading the whole file;
+# duplicates and invalid logins are dropped here so they never cost a request
+def iter_handles(path):
+    seen = set()
+    with open(path, 'r') as file:
+        for line in file:
+            handle = line.strip()
+            if not handle:
+                continue
+            if not LOGIN_PATTERN.match(handle):
+                logging.warning("user=%s status=invalid", handle)
+                continue
+            # Logins are case-insensitive
+            key = handle.lower()
+            if key in seen:
+                continue
+            seen.add(key)
+            yield handle
+
+# Adds every handle in handles.txt with the given role; url_for maps a handle to its membership URL
+def run(api_token, url_for, role, state_file, failed_handles_file):
+    # With no workers nothing would read the handle queue, so no request would ever be sent
+    if MAX_WORKERS < 1:
+        raise SystemExit("Set GH_CONCURRENCY to a number of workers of at least 1")
+
+    # The request body, serialized once for every PUT
+    body = json.dumps({"role": role}).encode()
+
+    # One session for the whole run, so the TLS connections to GitHub are reused across requests
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS))
+    session.headers.update({
+        "Accept": "application/vnd.github+json",
+        "Authorization": f"Bearer {api_token}",
+        "X-GitHub-Api-Version": "2022-11-28",
+        "Content-Type": "application/json"
+    })
+
+    # Load the membership ETags recorded by previous runs
+    try:
+        with open(state_file, 'r') as file:
+            state = json.load(file)
+    except (FileNotFoundError, ValueError):
+        state = {}
+
+    # Shared by all workers, so the rate limit applies to the run as a whole
+    limiter = RateLimiter(REQUESTS_PER_MINUTE, 60)
+    tracker = RateLimitTracker()
+    concurrency = AdaptiveConcurrencyLimiter(max_limit=MAX_WORKERS, target_latency=TARGET_LATENCY)
+
+    # Process the handles concurrently; the requests are I/O-bound, so threads overlap the round-trips
+    handle_queue = queue.Queue(maxsize=HANDLE_QUEUE_SIZE)
+    failed_handles = []
+    total_handles = 0
+    done_handles = 0
+    progress_lock = threading.Lock()
+
+    # Each worker picks up the next handle as soon as its previous one finishes, and reports
+    # progress against the handles queued so far
+    def worker():
+        nonlocal done_handles
+        while True:
+            handle = handle_queue.get()
+            if handle is None:
+                return
+            if not add_member(handle, url_for(handle), role, body, session, limiter, tracker, concurrency, state):
+                failed_handles.append(handle)
+            with progress_lock:
+                done_handles += 1
+                logging.info("progress=%d/%d failed=%d", done_handles, total_handles, len(failed_handles))
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(MAX_WORKERS)]
+    for thread in workers:
+        thread.start()
+
+    # Stream the handles from the file into the queue; one None per worker tells it to stop
+    for handle in iter_handles('handles.txt'):
+        handle_queue.put(handle)
+        total_handles += 1
+    for _ in workers:
+        handle_queue.put(None)
+    for thread in workers:
+        thread.join()
+
+    # Save the membership ETags for the next run
+    with open(state_file, 'w') as file:
+        json.dump(state, file)
+
+    # Record the handles that could not be added, so a re-run only has to process those
+    with open(failed_handles_file, 'w') as file:
+        file.writelines(f"{handle}\n" for handle in failed_handles)
+    # Only handles a worker actually processed count as added
+    logging.info("added=%d total=%d failed=%d failed_file=%s",
+                 done_handles - len(failed_handles), total_handles, len(failed_handles), failed_handles_file)